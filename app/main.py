@@ -1,7 +1,10 @@
+import atexit
 import configparser
 import os
 import logging
+import queue
 
+from logging.handlers import QueueHandler, QueueListener
 
 from migration.core.odoo import OdooConnection
 from migration.executor import Migration
@@ -22,38 +25,43 @@ def setup_logging(configs: configparser.ConfigParser):
     :param configs: The app configs.
     :param log_file: Path to the log file.
     :param log_level: Logging level (e.g., INFO, DEBUG, ERROR).
+    :return: The QueueListener writing the records, stopped at exit.
     """
     # Setup logging from config
     log_file = configs.get('settings', 'log_file', fallback='./logs/migration.log')
     log_level = configs.get('settings', 'log_level', fallback='info').upper()
+    level = getattr(logging, log_level, logging.INFO)
     os.makedirs(os.path.dirname(log_file), exist_ok=True)
-    logging.basicConfig(
-        filename=log_file,
-        level=getattr(logging, log_level, logging.INFO),
-        format='%(asctime)s %(levelname)s %(message)s',
-    )
 
     # Create a file handler
     file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(log_level)
 
     # Create a console handler
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(log_level)
 
     # Set up logging format
     formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
 
-    # Get the root logger
+    # Get the root logger, its level filters the records of both handlers
     logger = logging.getLogger()
-    logger.setLevel(log_level)
+    logger.setLevel(level)
+
+    # The root logger only enqueues the records, the file and console writes
+    # happen on the listener thread, off the migration threads
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler, console_handler)
+    logger.addHandler(QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+
+    # Keep the RPC libraries quiet unless something goes wrong
+    for name in ('odoorpc', 'urllib3'):
+        logging.getLogger(name).setLevel(logging.WARNING)
 
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
     logger.info(f"Logging initialized: {log_file} at level {log_level}")
+    return listener
 
 
 def main():
@@ -82,7 +90,11 @@ def main():
     migration = Migration(configs, src_odoo, dst_odoo, mappings_dir)
 
     # Start the migration process
-    migration.run()
+    try:
+        migration.run()
+    finally:
+        src_odoo.close()
+        dst_odoo.close()
 
 
 if __name__ == "__main__":
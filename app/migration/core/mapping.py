@@ -1,11 +1,67 @@
+import hashlib
+import heapq
 import json
+import logging
 import os
-import abc
 
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
 from configparser import ConfigParser
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple
 
 from ..core.odoo import OdooConnection
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+_logger = logging.getLogger(__name__)
+
+
+def encode_mappings(mappings: Dict[int, int]) -> bytes:
+    """
+    Serialize a mapping dict to JSON, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(mappings, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(mappings).encode('utf-8')
+
+
+def decode_mappings(data: bytes) -> Dict[int, int]:
+    """
+    Deserialize a mapping dict from JSON, with orjson when it is installed.
+    JSON object keys are always strings, so they are converted back to the source ids.
+    """
+    mappings = orjson.loads(data) if orjson is not None else json.loads(data)
+    return {int(source_id): dest_id for source_id, dest_id in mappings.items()}
+
+
+@contextmanager
+def atomic_write(path: str):
+    """
+    Open a file for writing in binary mode, replacing the previous file only once it is completely written,
+    so the other worker processes never read it half-written.
+    :param path: The path of the file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 
 class MappingLoader:
     def __init__(self, configs:ConfigParser, odoo_src: OdooConnection, odoo_dst: OdooConnection, mapping_dir: str):
@@ -13,37 +69,131 @@ class MappingLoader:
         self.odoo_src = odoo_src
         self.odoo_dst = odoo_dst
         self.mapping_dir = mapping_dir
-        self.cache = {}
+        self.cache = defaultdict(dict)
 
     def load_mapping_by_field_from_database(self, model_name: str, field_name: str):
-        if model_name not in self.cache:
-            self.cache[model_name] = {}
-
-        cache_model = self.cache.get(model_name)
-        eof = False
-        offset = 0
-        while not eof:
-            src_items = self.odoo_src.fetch_items(model_name, offset=offset, limit=100, order="id")
-            eof = (src_items is None or len(src_items) == 0)
-            if not eof:
-                for src_item in src_items:
-                    item_value = getattr(src_item, field_name)
-                    dst_items = self.odoo_src.search_by_field(
-                        model_name=model_name,
-                        field_name="name",
-                        value=item_value,
-                        limit=1)
-
-                    if dst_items and len(dst_items) > 0:
-                        cache_model[src_item['id']] = dst_items[0]
-
-            offset += 100
+        cache_model = self.cache[model_name]
+        # every page is resolved on the destination by this field
+        self.odoo_dst.ensure_index(model_name, [field_name])
+        dst_model = self.odoo_dst.get_model(model_name)
+        for src_items in self.odoo_src.iter_records(model_name, fields=[field_name]):
+            # resolve the whole page on the destination with a single IN query
+            values = [src_item[field_name] for src_item in src_items]
+            dst_items = dst_model.search_read([(field_name, 'in', values)], ['id', field_name], order='id')
+            dst_ids_by_value = {dst_item[field_name]: dst_item['id'] for dst_item in dst_items}
+
+            for src_item in src_items:
+                dst_id = dst_ids_by_value.get(src_item[field_name])
+                if dst_id:
+                    cache_model[src_item['id']] = dst_id
 
     def load_mapping_by_name_from_database(self, model_name: str):
         field_name = "name"
         self.load_mapping_by_field_from_database(model_name, field_name)
 
 
+class LargeMappingStore:
+    """
+    Source id -> destination id mapping for very large models (e.g. millions of product.product rows).
+    The ids are kept in two parallel arrays of 64-bit integers sorted by source id (~16 bytes per entry,
+    instead of ~200 for a dict) and looked up with a binary search.
+    New entries are buffered in a small dict and merged into the arrays by finalize().
+    The arrays are saved and loaded as is (see save() and load()), so no dict of the whole model is ever built.
+    """
+    # Minimum number of buffered entries that triggers a merge into the arrays
+    PENDING_LIMIT = 10000
+    # The buffer grows up to 1/PENDING_RATIO of the merged entries, so each merge (a copy of the arrays)
+    # is amortized over a number of inserts proportional to the size of the arrays
+    PENDING_RATIO = 16
+
+    def __init__(self):
+        self.src = array('q')
+        self.dst = array('q')
+        self._pending = {}
+
+    def _index(self, source_id: int) -> int:
+        i = bisect_left(self.src, source_id)
+        return i if i < len(self.src) and self.src[i] == source_id else -1
+
+    def get(self, source_id: int, default=None) -> Optional[int]:
+        if source_id in self._pending:
+            return self._pending[source_id]
+        i = self._index(source_id)
+        return self.dst[i] if i >= 0 else default
+
+    def __setitem__(self, source_id: int, dest_id: int):
+        i = self._index(source_id)
+        if i >= 0:
+            self.dst[i] = dest_id
+        else:
+            self._pending[source_id] = dest_id
+            if len(self._pending) >= max(self.PENDING_LIMIT, len(self.src) // self.PENDING_RATIO):
+                self.finalize()
+
+    def __len__(self) -> int:
+        return len(self.src) + len(self._pending)
+
+    def update(self, mappings: Dict[int, int]):
+        for source_id, dest_id in mappings.items():
+            self[source_id] = dest_id
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        self.finalize()
+        return zip(self.src, self.dst)
+
+    def _merge(self, pairs: Iterable[Tuple[int, int]]):
+        """
+        Merge (source id, destination id) pairs sorted by source id into the arrays.
+        The merged pairs win over the entries already in the arrays for the same source id.
+        """
+        src, dst = array('q'), array('q')
+        # heapq.merge is stable: for the same source id, the pair already in the arrays comes first
+        for source_id, dest_id in heapq.merge(zip(self.src, self.dst), pairs, key=itemgetter(0)):
+            if src and src[-1] == source_id:
+                dst[-1] = dest_id
+            else:
+                src.append(source_id)
+                dst.append(dest_id)
+        self.src, self.dst = src, dst
+
+    def finalize(self):
+        """
+        Merge the buffered entries into the sorted arrays.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        pairs = sorted(pending.items())
+        if not self.src or pairs[0][0] > self.src[-1]:
+            # the usual case when mapping the records in id order: the new ids go after the existing ones
+            self.src.extend(source_id for source_id, _ in pairs)
+            self.dst.extend(dest_id for _, dest_id in pairs)
+        else:
+            self._merge(pairs)
+
+    def save(self, f: BinaryIO):
+        """
+        Write the mappings into a binary file: the source ids, then the destination ids.
+        """
+        self.finalize()
+        self.src.tofile(f)
+        self.dst.tofile(f)
+
+    def load(self, f: BinaryIO):
+        """
+        Read the mappings written by save() from a binary file, merging them into the current ones.
+        """
+        count = os.fstat(f.fileno()).st_size // (2 * self.src.itemsize)
+        src, dst = array('q'), array('q')
+        src.fromfile(f, count)
+        dst.fromfile(f, count)
+        if not len(self):
+            self.src, self.dst = src, dst
+        else:
+            self.finalize()
+            self._merge(zip(src, dst))
+
+
 class MappingProvider:
 
     def __init__(self, configs: ConfigParser, odoo_src: OdooConnection, odoo_dst: OdooConnection, mapping_dir: str):
@@ -56,48 +206,188 @@ class MappingProvider:
             self.odoo_src = odoo_src
             self.odoo_dst = odoo_dst
             self.mapping_dir = mapping_dir
-            self.cache = {}  # In-memory cache for model mappings
+            self.cache = defaultdict(dict)  # In-memory cache for model mappings, by model and source id
+            # Models with too many records to keep their mappings in a dict
+            large_models = configs.get('settings', 'large_models', fallback='')
+            for model_name in filter(None, (name.strip() for name in large_models.split(','))):
+                self.cache[model_name] = LargeMappingStore()
+            self._meta_path = os.path.join(self.mapping_dir, '.meta.json')
+            self._lock_path = os.path.join(self.mapping_dir, '.lock')
+            # Models whose mappings changed with set_mapping() since they were loaded or saved
+            self._changed_models = set()
+            self.cache_hits = 0
+            self.cache_misses = 0
             os.makedirs(self.mapping_dir, exist_ok=True)
             self.initialized = True  # Mark as initialized
 
+    def get_mapping_file(self, model_name: str) -> str:
+        """
+        Return the path of the mapping file for the given model: a binary file for the large models
+        (see LargeMappingStore.save()), a JSON file otherwise.
+        :param model_name: The model name (e.g., 'res.groups', 'res.users').
+        """
+        extension = 'bin' if isinstance(self.cache.get(model_name), LargeMappingStore) else 'json'
+        return os.path.join(self.mapping_dir, f"{model_name}.{extension}")
+
     def load_mappings_from_files(self, model_name: str):
         """
         Load mappings from file into the in-memory cache for the given model if not already loaded.
         :param model_name: The model name (e.g., 'res.groups', 'res.users').
         """
-        mapping_file = os.path.join(self.mapping_dir, f"{model_name}.map")
-        if model_name not in self.cache:
-            self.cache[model_name] = {}
+        mapping_file = self.get_mapping_file(model_name)
+        if os.path.exists(mapping_file):
+            mappings = self.cache[model_name]
+            with open(mapping_file, 'rb') as f:
+                if isinstance(mappings, LargeMappingStore):
+                    mappings.load(f)
+                else:
+                    mappings.update(decode_mappings(f.read()))
+
+    def bootstrap_by_name(self, model_name: str):
+        """
+        Map the records of a model by name, joining the source records with the destination names in memory.
+        Meant for small models (e.g. 'res.groups'): only the destination names are kept, the source
+        records are streamed 1000 at a time and released once mapped.
+        :param model_name: The model name (e.g., 'res.groups', 'ir.module.category').
+        """
+        dst_ids_by_name = {}
+        for dst_items in self.odoo_dst.iter_records(model_name, fields=['name'], batch_size=1000):
+            for dst_item in dst_items:
+                dst_ids_by_name.setdefault(dst_item['name'], dst_item['id'])
 
         model_cache = self.cache[model_name]
-        if not os.path.exists(mapping_file):
-            with open(mapping_file, 'r') as f:
-                for line in f:
-                    source_id, dest_id = line.strip().split('=')
-                    self.cache[model_name][int(source_id.strip())] = int(dest_id.strip())
+        for src_items in self.odoo_src.iter_records(model_name, fields=['name'], batch_size=1000):
+            for src_item in src_items:
+                dst_id = dst_ids_by_name.get(src_item['name'])
+                if dst_id:
+                    model_cache[src_item['id']] = dst_id
 
     def load_mappings_from_database(self, model_name: str, field_name: str):
+        if field_name.lower() == "name" and not isinstance(self.cache[model_name], LargeMappingStore):
+            self.bootstrap_by_name(model_name)
+            return
+
         mapping_loader = MappingLoader(configs=self.configs, odoo_src=self.odoo_src, odoo_dst=self.odoo_dst,
                                        mapping_dir=self.mapping_dir)
+        # the pages are mapped straight into the cache, so no intermediate dict of the whole model is built
+        mapping_loader.cache[model_name] = self.cache[model_name]
         if field_name.lower() == "name":
             mapping_loader.load_mapping_by_name_from_database(model_name)
         else:
             mapping_loader.load_mapping_by_field_from_database(model_name, field_name)
 
+    def get_model_signature(self, odoo: OdooConnection, model_name: str) -> str:
+        """
+        Build a signature that changes whenever the records of a model change on the given Odoo instance.
+        :param odoo: The odoo connection.
+        :param model_name: The model name (e.g., 'res.groups', 'res.users').
+        :return: The signature, made of the database location, the record count and the last write date.
+        """
+        model = odoo.get_model(model_name)
+        last_written = model.search_read([], ['write_date'], order='write_date desc', limit=1)
+        write_date = last_written[0]['write_date'] if last_written else None
+        count = model.search_count([])
+        return f"{odoo.host}:{odoo.port}/{odoo.db}|{count}|{write_date}"
+
+    def get_cache_key(self, model_name: str, field_name: str) -> str:
+        """
+        Compute the cache key of the mappings of a model, based on both source and destination signatures.
+        :param model_name: The model name (e.g., 'res.groups', 'res.users').
+        :param field_name: The field used to match the records.
+        :return: The SHA1 hex digest of the key.
+        """
+        key = "|".join([
+            model_name,
+            field_name,
+            self.get_model_signature(self.odoo_src, model_name),
+            self.get_model_signature(self.odoo_dst, model_name),
+        ])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def load_meta(self) -> dict:
+        if not os.path.exists(self._meta_path):
+            return {}
+        with open(self._meta_path, 'r') as f:
+            return json.load(f)
+
+    def save_meta(self, meta: dict):
+        with atomic_write(self._meta_path) as f:
+            f.write(json.dumps(meta).encode('utf-8'))
+
+    @contextmanager
+    def lock(self):
+        """
+        Hold an exclusive lock on the mappings directory, shared by the worker processes
+        (no lock where fcntl is not available).
+        """
+        with open(self._lock_path, 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # closing the file releases the lock
+            yield
+
+    def load_mappings(self, model_name: str, field_name: str):
+        """
+        Load the mappings of a model, reusing the mapping file when neither the source nor the destination
+        records changed since it was written, and refreshing it from the databases otherwise.
+        :param model_name: The model name (e.g., 'res.groups', 'res.users').
+        :param field_name: The field used to match the records.
+        """
+        cache_key = self.get_cache_key(model_name, field_name)
+        meta = self.load_meta()
+        if meta.get(model_name) == cache_key and os.path.exists(self.get_mapping_file(model_name)):
+            _logger.info(f"Loading {model_name} mappings from file ...")
+            self.load_mappings_from_files(model_name)
+            self.cache_hits += 1
+            return
+
+        _logger.info(f"Loading {model_name} mappings from database ...")
+        self.load_mappings_from_database(model_name, field_name)
+        self.save_mappings(model_name)
+        # read again under the lock, the other workers may have updated it in the meantime
+        with self.lock():
+            meta = self.load_meta()
+            meta[model_name] = cache_key
+            self.save_meta(meta)
+        self.cache_misses += 1
+
+    def cache_stats(self) -> dict:
+        """
+        Return how many mapping loads were served from file (hits) and from the databases (misses).
+        """
+        return {'hits': self.cache_hits, 'misses': self.cache_misses}
+
     def save_mappings(self, model_name: str):
         """
         Save the in-memory mappings to a file for the given model.
         :param model_name: The model name (e.g., 'res.groups', 'res.users').
         """
-        mapping_file = os.path.join(self.mapping_dir, f"{model_name}.map")
-        with open(mapping_file, 'w') as f:
-            for source_id, dest_id in self.cache[model_name].items():
-                f.write(f"{source_id}->{dest_id}\n")
+        mapping_file = self.get_mapping_file(model_name)
+        mappings = self.cache[model_name]
+        with atomic_write(mapping_file) as f:
+            if isinstance(mappings, LargeMappingStore):
+                mappings.save(f)
+            else:
+                f.write(encode_mappings(mappings))
+        self._changed_models.discard(model_name)
 
     def save_all_mappings(self):
-        for model_name in self.cache:
+        """
+        Save the mappings changed with set_mapping() since they were loaded or saved, leaving the files
+        of the other models (maybe being written by other workers) untouched.
+        """
+        for model_name in list(self._changed_models):
             self.save_mappings(model_name)
 
+    def get_model_mappings(self, model_name: str):
+        """
+        Return the whole source id -> destination id mapping of a model, for handlers doing many lookups.
+        It is the cache itself (a dict, or a LargeMappingStore for the large models), not a copy,
+        so the mappings set afterwards with set_mapping() are visible through it.
+        :param model_name: The model name (e.g., 'res.groups', 'res.users').
+        """
+        return self.cache[model_name]
+
     def get_mapping(self, model_name: str, source_id: int) -> int:
         """
         Get the destination ID for a given source ID in a specific model.
@@ -105,10 +395,9 @@ class MappingProvider:
         :param source_id: The source ID.
         :return: The destination ID, or None if not found.
         """
-        if model_name not in self.cache:
-            self.cache[model_name] = {}
-        mapped_model = self.cache.get(model_name)
-        return mapped_model.get(source_id)
+        # cache.get: a lookup on a model without mappings must not add an empty one to the cache
+        mappings = self.cache.get(model_name)
+        return mappings.get(source_id) if mappings is not None else None
 
     def set_mapping(self, model_name: str, source_id: int, dest_id: int):
         """
@@ -118,6 +407,5 @@ class MappingProvider:
         :param source_id: The source ID.
         :param dest_id: The destination ID.
         """
-        if model_name not in self.cache:
-            self.cache[model_name] = {}
-        self.cache[model_name][source_id] = dest_id
\ No newline at end of file
+        self.cache[model_name][source_id] = dest_id
+        self._changed_models.add(model_name)
\ No newline at end of file
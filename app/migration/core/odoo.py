@@ -1,9 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser, NoOptionError, NoSectionError
-from typing import List, Dict, Optional
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Dict, Optional
 
 import odoorpc
 import logging
-import os
+
+from .transport import KeepAliveHandler, build_keep_alive_opener, use_orjson_transport
+
+try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.sql
+except ImportError:
+    psycopg2 = None
 
 _logger = logging.getLogger(__name__)
 
@@ -15,82 +25,252 @@ class OdooConnection:
         :param configs: The app configuration.
         :param connection_type: Type of connection ('source' or 'destination').
         """
+        self.session = None
+        self._model_cache: Dict[str, Any] = {}
+        self._db = None
+        self._rpc_executor: Optional[ThreadPoolExecutor] = None
+        self._opener = None
         try:
             self.connection_type = connection_type
-            self.host = configs.get(self.connection_type, 'host')
-            self.port = configs.getint(self.connection_type, 'port')
-            self.db = configs.get(self.connection_type, 'database')
-            self.username = configs.get(self.connection_type, 'username')
-            self.password = configs.get(self.connection_type, 'password')
-            self.host = configs.get(self.connection_type, 'host')
+            # Read the whole section at once instead of resolving each option separately
+            section = dict(configs.items(self.connection_type))
+            self.host = section['host']
+            self.port = int(section['port'])
+            self.db = section['database']
+            self.username = section['username']
+            self.password = section['password']
+            # Optional libpq connection string of the Odoo database, for direct SQL access
+            self.dsn = section.get('dsn')
 
             # Load the preferred language and company_id from the 'settings' section
             self.language = configs.get('settings', 'language', fallback='en_US')
             self.company_id = configs.getint('settings', 'company_id', fallback=1)
+            # Maximum number of RPC calls sent concurrently by map_calls()
+            self.rpc_workers = max(1, configs.getint('settings', 'rpc_workers', fallback=1))
+            # Whether ensure_index() may create indexes on the database (requires the 'dsn' option)
+            self.create_indexes = configs.getboolean('settings', 'create_indexes', fallback=False)
 
         except NoSectionError as e:
             _logger.error(f"Configuration error: section '{self.connection_type}' not found: {e}")
             raise e
-        except NoOptionError as e:
-            _logger.error(f"Configuration error: missing option in section '{self.connection_type}': {e}")
-            raise e
+        except KeyError as e:
+            error = NoOptionError(e.args[0], self.connection_type)
+            _logger.error(f"Configuration error: missing option in section '{self.connection_type}': {error}")
+            raise error
 
     def connect(self):
         """
         Establish a connection to the Odoo instance based on the configuration.
         This method can be called separately after initialization.
+        The RPC calls of the session reuse persistent HTTP connections, and their JSON payloads are
+        encoded and decoded with orjson when it is installed.
         """
         try:
-            self.session = odoorpc.ODOO(host=self.host, port=self.port)
+            use_orjson_transport()
+            self._opener = build_keep_alive_opener()
+            self.session = odoorpc.ODOO(host=self.host, port=self.port, opener=self._opener)
             self.session.login(self.db, self.username, self.password)
             _logger.info(f"Connected to Odoo {self.connection_type} at {self.host}:{self.port}, database: {self.db}")
         except Exception as e:
             _logger.error(f"Failed to connect on Odoo {self.connection_type} at {self.host}:{self.port}: {e}")
             raise e
 
+    def close(self):
+        """
+        Release what the connection holds: the RPC worker threads, the persistent HTTP connections
+        and the direct database connection.
+        """
+        if self._rpc_executor is not None:
+            self._rpc_executor.shutdown()
+            self._rpc_executor = None
+        if self._opener is not None:
+            # OpenerDirector.close() doesn't close its handlers
+            for handler in self._opener.handlers:
+                if isinstance(handler, KeepAliveHandler):
+                    handler.close()
+            self._opener = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        self.session = None
+        self._model_cache.clear()
+
+    @property
+    def has_database_access(self) -> bool:
+        """
+        Whether the Odoo database can be reached directly (a 'dsn' is configured and psycopg2 is installed).
+        """
+        return self.dsn is not None and psycopg2 is not None
+
+    @contextmanager
+    def cursor(self):
+        """
+        Open a cursor on the Odoo database itself, bypassing the RPC layer.
+        The transaction is committed when the block exits normally and rolled back on errors.
+        Requires the 'dsn' option in the connection section and psycopg2.
+        """
+        db = self._get_db()
+        with db:
+            with db.cursor() as cr:
+                yield cr
+
+    def _get_db(self):
+        """
+        Return the direct connection to the Odoo database, opening it on first use.
+        """
+        if not self.has_database_access:
+            raise Exception(f"Direct database access to the {self.connection_type} Odoo instance is not configured.")
+        if self._db is None or self._db.closed:
+            self._db = psycopg2.connect(self.dsn)
+        return self._db
+
+    def ensure_index(self, model_name: str, columns: List[str]):
+        """
+        Create a btree index on columns of a model table, unless it already exists, so the lookups
+        of the migration by those columns don't scan the whole table.
+        Only when the 'create_indexes' setting is enabled and the database is reachable directly.
+        The index is built CONCURRENTLY, so the table stays writable, and it is left in place afterwards.
+        Translated columns (jsonb, searched by language) are skipped: a btree on them isn't used.
+        :param model_name: The model name (e.g., 'res.partner').
+        :param columns: The indexed columns, in order.
+        """
+        if not self.create_indexes or not self.has_database_access:
+            return
+        fields = self.get_model(model_name).fields_get(columns, attributes=['translate'])
+        if any(fields.get(column, {}).get('translate') for column in columns):
+            _logger.info(f"Not indexing the translated columns {columns} of {model_name}")
+            return
+
+        table = model_name.replace('.', '_')
+        index_name = f"{table}_{'_'.join(columns)}_migration_idx"
+        query = psycopg2.sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})").format(
+            psycopg2.sql.Identifier(index_name),
+            psycopg2.sql.Identifier(table),
+            psycopg2.sql.SQL(', ').join(map(psycopg2.sql.Identifier, columns)),
+        )
+        db = self._get_db()
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+        autocommit, db.autocommit = db.autocommit, True
+        try:
+            with db.cursor() as cr:
+                cr.execute(query)
+        finally:
+            db.autocommit = autocommit
+        _logger.info(f"Ensured index {index_name} on the {self.connection_type} database")
+
+    def bulk_set_new_id(self, model_name: str, new_ids_by_id: Dict[int, int]):
+        """
+        Write the destination ids on the new_id field of records of this instance (usually the source).
+        With direct database access it is a single UPDATE ... FROM (VALUES ...) statement, otherwise
+        one write call per distinct new_id, sent concurrently (see map_calls).
+        :param model_name: The model name (e.g., 'res.partner', 'res.users').
+        :param new_ids_by_id: The new_id to write, by record id.
+        """
+        if not new_ids_by_id:
+            return
+        if self.has_database_access:
+            table = psycopg2.sql.Identifier(model_name.replace('.', '_'))
+            query = psycopg2.sql.SQL("UPDATE {} SET new_id = data.new_id FROM (VALUES %s) AS data(id, new_id) "
+                                     "WHERE {}.id = data.id").format(table, table)
+            with self.cursor() as cr:
+                psycopg2.extras.execute_values(cr, query, list(new_ids_by_id.items()), page_size=len(new_ids_by_id))
+            return
+
+        ids_by_new_id: Dict[int, List[int]] = {}
+        for record_id, new_id in new_ids_by_id.items():
+            ids_by_new_id.setdefault(new_id, []).append(record_id)
+        model = self.get_model(model_name)
+        self.map_calls(lambda item: model.write(item[1], {'new_id': item[0]}), list(ids_by_new_id.items()))
+
+    def map_calls(self, func: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+        """
+        Call func for each item, keeping up to rpc_workers calls in flight at the same time, so the
+        round trips of independent RPC calls overlap instead of adding up.
+        The worker threads are kept for the whole connection, so each one reuses its HTTP connection.
+        :param func: The function doing the RPC call(s) for a single item.
+        :param items: The items.
+        :return: The results, in the same order as the items.
+        """
+        if self.rpc_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        if self._rpc_executor is None:
+            self._rpc_executor = ThreadPoolExecutor(max_workers=self.rpc_workers,
+                                                    thread_name_prefix=f"rpc-{self.connection_type}")
+        return list(self._rpc_executor.map(func, items))
+
     def get_model(self, model_name: str) -> odoorpc.models.Model:
         """
         Retrieve the model from the Odoo connection.
+        The model proxies are cached, so they are resolved only once per connection.
         :param model_name: The name of the model to interact with (e.g., 'res.users').
         :return: The model instance.
         """
+        model = self._model_cache.get(model_name)
+        if model is not None:
+            return model
+
         if not self.session:
             raise Exception(f"Connection to {self.connection_type} Odoo instance is not established.")
         try:
-            return self.session.env[model_name]
+            model = self.session.env[model_name]
         except Exception as e:
             _logger.error(f"Failed to retrieve model '{model_name}': {e}")
             raise e
+        self._model_cache[model_name] = model
+        return model
 
     def search_by_field(self, model_name: str, field_name: str, value, limit: int = 1):
-        model = self.session.env[model_name]
+        model = self.get_model(model_name)
         domain = [(field_name, '=', value)]
         return model.search(domain, limit=limit)
 
-    def fetch_ids(self, model_name: str, domain=None, offset: int = 0, order: str = None,
-                  limit: int = 100) -> List[Dict]:
+    def fetch_ids(self, model_name: str, domain=None, order: str = None, limit: int = 100) -> List[int]:
         domain = [] if domain is None else domain
-        model = self.session.env[model_name]
-        ids = model.search(domain, offset=offset, limit=limit, order=order)
+        model = self.get_model(model_name)
+        ids = model.search(domain, limit=limit, order=order)
         return ids
 
-    def fetch_items(self, model_name: str, domain=None, offset: int = 0,
-                    order: str = None,
-                    limit: int = 100) -> List[Dict]:
+    def fetch_items(self, model_name: str, domain=None, order: str = None,
+                    limit: int = 100, fields: List[str] = None) -> List[Dict]:
         """
         Retrieve a list of records based on a search domain and convert them to dictionaries.
+        Pagination is keyset based: extend the domain with ('id', '>', last_id) and order by id
+        to get the next page.
         :param model_name: The model name (e.g., 'res.partner', 'res.users').
         :param domain: The search domain.
-        :param offset: The offset for pagination.
         :param limit: The number of records to retrieve.
         :param order: The order for sorting the results.
+        :param fields: The fields to read (all fields when not informed).
         :return: A list of records as dictionaries.
         """
-        result = []
+        domain = [] if domain is None else domain
+        # search and read in a single round trip, the records come back as plain dicts
+        model = self.get_model(model_name)
+        return model.search_read(domain, fields, limit=limit, order=order)
 
-        ids = self.fetch_ids(model_name, domain=domain, offset=offset, order=order, limit=limit)
-        for item_id in ids:
-            model = self.session.env[model_name]
-            item = model.browse(item_id)
-            result.append(item)
-        return result
+    def iter_records(self, model_name: str, domain=None, fields: List[str] = None,
+                     batch_size: int = 500, context: Dict = None) -> Iterator[List[Dict]]:
+        """
+        Stream the records of a model in batches, each one read with a single search_read,
+        so only one batch is held in memory at a time.
+        Pagination is keyset based (id > last id of the previous batch), so deep pages cost the same
+        as the first one, and it stops on the first short batch without requesting an empty one.
+        :param model_name: The model name (e.g., 'res.partner', 'res.users').
+        :param domain: The search domain.
+        :param fields: The fields to read (all fields when not informed).
+        :param batch_size: The number of records per batch.
+        :param context: The context of the queries (e.g. {'lang': 'en_US'}), the session one when not informed.
+        :return: An iterator of batches, as lists of records.
+        """
+        domain = [] if domain is None else domain
+        model = self.get_model(model_name)
+        kwargs = {} if context is None else {'context': context}
+        last_id = 0
+        while True:
+            batch = model.search_read(domain + [('id', '>', last_id)], fields, limit=batch_size, order='id', **kwargs)
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1]['id']
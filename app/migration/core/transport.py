@@ -0,0 +1,158 @@
+import http.client
+import json
+import selectors
+import threading
+import urllib.error
+import urllib.request
+
+from http.cookiejar import CookieJar
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """
+    urllib handler that keeps one persistent connection per host (and thread), instead of opening
+    and closing a new connection for every request like the default urllib handlers do.
+    """
+
+    def __init__(self):
+        urllib.request.HTTPSHandler.__init__(self)
+        self._local = threading.local()
+        # every connection opened, whatever the thread, so they can all be closed at the end
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def http_open(self, req):
+        return self._open(http.client.HTTPConnection, req)
+
+    def https_open(self, req):
+        return self._open(http.client.HTTPSConnection, req, context=self._context)
+
+    def _get_connection(self, connection_class, host: str, timeout, **kwargs) -> http.client.HTTPConnection:
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get((connection_class, host))
+        if connection is None:
+            connection = connection_class(host, timeout=timeout, **kwargs)
+            connections[(connection_class, host)] = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        """
+        Close the connections of every thread.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        super().close()
+
+    @staticmethod
+    def _is_dropped(connection: http.client.HTTPConnection) -> bool:
+        """
+        Whether the server closed an idle connection: its socket is readable (EOF) while no request is pending.
+        """
+        if connection.sock is None:
+            return False
+        with selectors.DefaultSelector() as selector:
+            selector.register(connection.sock, selectors.EVENT_READ)
+            return bool(selector.select(0))
+
+    def _open(self, connection_class, req, **kwargs):
+        if not req.host:
+            raise urllib.error.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update({key: value for key, value in req.headers.items() if key not in headers})
+        headers['Connection'] = 'keep-alive'
+        headers = {name.title(): value for name, value in headers.items()}
+
+        connection = self._get_connection(connection_class, req.host, req.timeout, **kwargs)
+        if self._is_dropped(connection):
+            connection.close()
+        reused = connection.sock is not None
+        try:
+            try:
+                connection.request(req.get_method(), req.selector, req.data, headers)
+            except (http.client.HTTPException, ConnectionError):
+                if not reused:
+                    raise
+                # the request couldn't be sent on the idle connection, so the server never got it:
+                # reconnect and send it again. Once sent, a request is never sent twice (it may be a create).
+                connection.close()
+                connection.request(req.get_method(), req.selector, req.data, headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, OSError) as e:
+            connection.close()
+            raise urllib.error.URLError(e)
+
+        # Same attributes urllib sets on the responses of its own handlers
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
+
+
+def build_keep_alive_opener() -> urllib.request.OpenerDirector:
+    """
+    Build the urllib opener used by odoorpc, keeping the session cookies like the odoorpc default one,
+    but reusing the HTTP connections.
+    """
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), KeepAliveHandler())
+
+
+class OrjsonModule:
+    """
+    Stand-in for the json module used by the odoorpc JSON-RPC client, encoding and decoding
+    the payloads with orjson. Anything it doesn't cover is delegated to the json module.
+    """
+
+    def __getattr__(self, name):
+        return getattr(json, name)
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        if kwargs:
+            return json.dumps(obj, **kwargs)
+        try:
+            # bytes: orjson doesn't escape non-ASCII characters, so the payload is sent as UTF-8 as is
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return json.dumps(obj)
+
+    @staticmethod
+    def loads(s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+    @staticmethod
+    def load(fp, **kwargs):
+        if kwargs:
+            return json.load(fp, **kwargs)
+        return orjson.loads(fp.read())
+
+
+def use_orjson_transport() -> bool:
+    """
+    Make the odoorpc JSON-RPC client serialize its requests and responses with orjson, when it is installed.
+    :return: True when orjson is used.
+    """
+    if orjson is None:
+        return False
+    from odoorpc.rpc import jsonrpclib
+    if isinstance(jsonrpclib.json, OrjsonModule):
+        return True
+
+    encode_data = getattr(jsonrpclib, 'encode_data', None)
+    if encode_data is not None:
+        # the payloads encoded by orjson are already bytes
+        jsonrpclib.encode_data = lambda data: data if isinstance(data, bytes) else encode_data(data)
+    jsonrpclib.json = OrjsonModule()
+    return True
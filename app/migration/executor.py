@@ -1,16 +1,29 @@
 import logging
+import multiprocessing
+import queue
+import threading
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from configparser import ConfigParser
+from graphlib import TopologicalSorter
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
 
-from .handlers.base import ResourceNotFoundException, HandlerNotFoundException
+from .handlers.base import DomainHandler, ResourceNotFoundException, HandlerNotFoundException
 from .handlers.res_users import ResUsersHandler
-# from .handlers.res_partner import ResPartnerHandler
+from .handlers.res_partner import ResPartnerHandler
 from .core.mapping import MappingProvider
 from .core.odoo import OdooConnection
 
 
 _logger = logging.getLogger(__name__)
 
+# Default maximum number of pages waiting between two pipeline stages
+_PIPELINE_QUEUE_SIZE = 4
+_QUEUE_TIMEOUT = 0.5
+# Marks the end of the records flowing through the pipeline
+_EOF = None
+
 
 class Migration:
 
@@ -25,49 +38,142 @@ class Migration:
         self.configgs = configs
         self.src_odoo = src_odoo
         self.dst_odoo = dst_odoo
+        self.mappings_dir = mappings_dir
+        self.workers = configs.getint('settings', 'workers', fallback=1)
+        self.pipeline_queue_size = configs.getint('settings', 'pipeline_queue_size', fallback=_PIPELINE_QUEUE_SIZE)
         self.mappings_provider = MappingProvider(configs, src_odoo, dst_odoo, mappings_dir)
-        self.mappings_provider.load_mappings_from_database("res.groups", "name")
 
         self.models_to_migrate = [
             'res.users',
             # 'res.partner'
         ]
-        self.models_handlers = {
-            'res.users': ResUsersHandler(self.src_odoo, self.dst_odoo, self.mappings_provider),
-            # 'res.partner': ResPartnerHandler(self.src_odoo, self.dst_odoo, self.mappings_provider)
+        # Handlers are only instantiated (and their mappings loaded) when the model is migrated
+        self._handler_factories = {
+            'res.users': ResUsersHandler,
+            'res.partner': ResPartnerHandler,
         }
+        self._handler_instances = {}
+        self._loaded_mappings = set()
+
+    def _get_handler(self, model_name: str) -> DomainHandler:
+        """
+        Return the handler of a model, creating it on first access.
+        :param model_name: The name of the model (e.g., 'res.groups', 'res.users').
+        """
+        handler = self._handler_instances.get(model_name)
+        if handler is None:
+            handler_class = self._handler_factories.get(model_name)
+            if handler_class is None:
+                raise HandlerNotFoundException(f"There is no handler for the model {model_name}!")
+
+            for mapping in handler_class.MAPPINGS:
+                if mapping not in self._loaded_mappings:
+                    self.mappings_provider.load_mappings(*mapping)
+                    self._loaded_mappings.add(mapping)
+
+            handler = handler_class(self.src_odoo, self.dst_odoo, self.mappings_provider)
+            self._handler_instances[model_name] = handler
+        return handler
+
+    @staticmethod
+    def _put(target_queue: queue.Queue, item, stop: threading.Event) -> bool:
+        """
+        Put an item into a pipeline queue, giving up when the pipeline is stopped.
+        :return: True if the item was queued, False if the pipeline was stopped.
+        """
+        while not stop.is_set():
+            try:
+                target_queue.put(item, timeout=_QUEUE_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
 
+    @staticmethod
+    def _get(source_queue: queue.Queue, stop: threading.Event):
+        """
+        Get an item from a pipeline queue, returning the EOF sentinel when the pipeline is stopped.
+        """
+        while not stop.is_set():
+            try:
+                return source_queue.get(timeout=_QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
+        return _EOF
+
+    def _fetch_stage(self, handler: DomainHandler, model_name: str, batch_size: int, fetch_queue: queue.Queue,
+                     stop: threading.Event):
+        """
+        Fetch the source records page by page and queue them.
+        """
+        try:
+            for records in handler.iter_pages(model_name, batch_size):
+                _logger.info("Fetched %s records for %s. Applying transformations...", len(records), model_name)
+                if not self._put(fetch_queue, records, stop):
+                    return
+            self._put(fetch_queue, _EOF, stop)
+        except Exception:
+            stop.set()
+            raise
+
+    def _transform_stage(self, handler: DomainHandler, model_name: str, fetch_queue: queue.Queue,
+                         write_queue: queue.Queue, stop: threading.Event):
+        """
+        Apply the handler transformations to each fetched page and queue the result for saving.
+        """
+        try:
+            while True:
+                records = self._get(fetch_queue, stop)
+                if records is _EOF:
+                    break
+                handler.prefetch(records)
+                transformed_records = handler.dedupe(handler.apply_transformations_batch(records))
+
+                _logger.info("Transformations complete for %s. Saving into destination...", model_name)
+                if not self._put(write_queue, transformed_records, stop):
+                    return
+            self._put(write_queue, _EOF, stop)
+        except Exception:
+            stop.set()
+            raise
+
+    def _save_stage(self, handler: DomainHandler, write_queue: queue.Queue, stop: threading.Event):
+        """
+        Save each transformed page into the destination.
+        """
+        try:
+            while True:
+                transformed_records = self._get(write_queue, stop)
+                if transformed_records is _EOF:
+                    break
+                handler.save_into_destination(transformed_records)
+        except Exception:
+            stop.set()
+            raise
 
     def migrate_model(self, model_name: str):
         """
         Migrate a specific model from the source Odoo system to the destination Odoo system.
+        Fetching, transforming and saving run as a pipeline on separate threads, so the source and
+        destination round trips of consecutive pages overlap.
         :param model_name: The name of the model (e.g., 'res.groups', 'res.users').
         """
         try:
             _logger.info(f"Starting migration for {model_name}...")
-            handler = self.models_handlers.get(model_name)
-            if handler is None or not handler:
-                raise HandlerNotFoundException(f"There is no handler for the model {model_name}!")
+            handler = self._get_handler(model_name)
 
-            # Fetch records from the source system
-            eof = False
-            offset = 0
-            batch_size = 100
-            while not eof:
-                records = handler.fetch_items(handler.src_odoo, model_name, limit=batch_size, order="id")
-                eof = records is not None and len(records) < 1
-                if not eof:
-                    _logger.info(f"Fetched {len(records)} records for {model_name}. Applying transformations...")
-                    # Apply transformations
-                    transformed_records = []
-                    for record in records:
-                        transformed_records += handler.apply_transformations(record)
-
-                    _logger.info(f"Transformations complete for {model_name}. Saving into destination...")
-
-                    # Insert transformed records into the destination
-                    handler.save_into_destination(transformed_records)
-                offset += batch_size
+            batch_size = handler.FETCH_BATCH_SIZE
+            fetch_queue = queue.Queue(maxsize=self.pipeline_queue_size)
+            write_queue = queue.Queue(maxsize=self.pipeline_queue_size)
+            stop = threading.Event()
+            with ThreadPoolExecutor(max_workers=3, thread_name_prefix=f"migrate-{model_name}") as executor:
+                stages = [
+                    executor.submit(self._fetch_stage, handler, model_name, batch_size, fetch_queue, stop),
+                    executor.submit(self._transform_stage, handler, model_name, fetch_queue, write_queue, stop),
+                    executor.submit(self._save_stage, handler, write_queue, stop),
+                ]
+                for stage in stages:
+                    stage.result()
 
             _logger.info(f"Migration complete for {model_name}.")
         except ResourceNotFoundException as e:
@@ -75,14 +181,90 @@ class Migration:
         except Exception as e:
             _logger.error(f"Unexpected error during migration of {model_name}: {str(e)}")
 
+    def get_dependency_graph(self) -> Dict[str, set]:
+        """
+        Build the dependency graph of the models to migrate, based on the handlers DEPENDS_ON attribute.
+        :return: A dict mapping each model to the set of models it depends on.
+        """
+        graph = {}
+        for model_name in self.models_to_migrate:
+            handler_class = self._handler_factories.get(model_name)
+            depends_on = handler_class.DEPENDS_ON if handler_class is not None else []
+            graph[model_name] = {dependency for dependency in depends_on if dependency in self.models_to_migrate}
+        return graph
+
     def run(self):
         """
         Run the migration process by migrating models in the correct sequence.
+        Models whose dependencies are already migrated are migrated in parallel when the
+        'workers' setting is greater than 1, each one in its own process.
         """
         _logger.info("Starting migration process...")
 
-        # Migrate each model in the correct sequence
-        for model_name in self.models_to_migrate:
-            self.migrate_model(model_name)
+        sorter = TopologicalSorter(self.get_dependency_graph())
+        sorter.prepare()
+        if self.workers <= 1:
+            while sorter.is_active():
+                for model_name in sorter.get_ready():
+                    self.migrate_model(model_name)
+                    sorter.done(model_name)
+        else:
+            # odoorpc sessions can't be pickled, so each worker opens its own connections
+            configs = {section: dict(self.configgs.items(section, raw=True)) for section in self.configgs.sections()}
+
+            # The workers send their log records back to this process' handlers
+            root_logger = logging.getLogger()
+            log_queue = multiprocessing.Queue(-1)
+            log_listener = QueueListener(log_queue, *root_logger.handlers)
+            log_listener.start()
+            try:
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker_logging,
+                                         initargs=(log_queue, root_logger.level)) as executor:
+                    while sorter.is_active():
+                        futures = {
+                            executor.submit(_migrate_model_worker, configs, self.mappings_dir, model_name): model_name
+                            for model_name in sorter.get_ready()
+                        }
+                        for future in as_completed(futures):
+                            future.result()
+                            sorter.done(futures[future])
+            finally:
+                log_listener.stop()
 
         _logger.info("Migration process completed successfully.")
+
+
+def _init_worker_logging(log_queue: multiprocessing.Queue, level: int):
+    """
+    Route the log records of a worker process to the parent process.
+    :param log_queue: The queue consumed by the parent process.
+    :param level: The level of the parent root logger.
+    """
+    root_logger = logging.getLogger()
+    root_logger.handlers = [QueueHandler(log_queue)]
+    root_logger.setLevel(level)
+
+
+def _migrate_model_worker(configs: Dict[str, Dict[str, str]], mappings_dir: str, model_name: str):
+    """
+    Migrate a single model in a worker process, with its own Odoo connections.
+    The mappings are saved when done, so the models depending on this one can load them.
+    :param configs: The application configs, as a dict of sections.
+    :param mappings_dir: Mappings directory.
+    :param model_name: The name of the model (e.g., 'res.groups', 'res.users').
+    """
+    parser = ConfigParser()
+    parser.read_dict(configs)
+
+    src_odoo = OdooConnection(parser, connection_type="source")
+    dst_odoo = OdooConnection(parser, connection_type="destination")
+    try:
+        src_odoo.connect()
+        dst_odoo.connect()
+
+        migration = Migration(parser, src_odoo, dst_odoo, mappings_dir)
+        migration.migrate_model(model_name)
+        migration.mappings_provider.save_all_mappings()
+    finally:
+        src_odoo.close()
+        dst_odoo.close()
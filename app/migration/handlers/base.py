@@ -1,6 +1,6 @@
 import logging
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Hashable, Iterator, NamedTuple, Optional, Tuple
 from ..core.odoo import OdooConnection
 
 
@@ -21,7 +21,39 @@ class ResourceNotFoundException(Exception):
         super().__init__(self.message)
 
 
+class Op(NamedTuple):
+    """A transformed record: what to do in the destination, on which model, with which values."""
+    action: str
+    model: str
+    data: Dict
+    # source values needed when saving (e.g. the source id), so the source record isn't read again
+    src_fields: Optional[Dict] = None
+    # the destination record to update, when already known
+    dst_id: Optional[int] = None
+
+
+def chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Split a list into consecutive chunks of at most `size` items.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 class DomainHandler:
+    # (model_name, field_name) mappings that must be loaded before the handler is used
+    MAPPINGS: List[Tuple[str, str]] = []
+    # Models that must be migrated before this one
+    DEPENDS_ON: List[str] = []
+    # Source fields read for the handled model (all fields when None)
+    FIELDS: List[str] = None
+    # Number of source records fetched (and transformed and saved) at a time
+    FETCH_BATCH_SIZE = 500
+    # Maximum number of records sent in a single create call
+    CREATE_BATCH_SIZE = 200
+    # Maximum number of destination records preloaded in memory by load_dst_ids_by_key()
+    PRELOAD_LIMIT = 50000
+
     def __init__(self, src_odoo: OdooConnection, dst_odoo: OdooConnection, model_name: str):
         """
         Initialize the DomainHandler with source and destination Odoo connections and the model name.
@@ -35,11 +67,18 @@ class DomainHandler:
 
     def get_src_model(self) -> Any:
         """Return the source Odoo model instance."""
-        return self.src_odoo.session.env[self.model_name]
+        return self.src_odoo.get_model(self.model_name)
 
     def get_dst_model(self) -> Any:
         """Return the source Odoo model instance."""
-        return self.dst_odoo.session.env[self.model_name]
+        return self.dst_odoo.get_model(self.model_name)
+
+    def get_fields(self, model_name: str) -> List[str]:
+        """
+        Return the fields to read for a model: the handler FIELDS for the handled model, all fields otherwise.
+        :param model_name: The model name (e.g., 'res.partner', 'res.users').
+        """
+        return self.FIELDS if model_name == self.model_name else None
 
     def record_exists(self, odoo: OdooConnection, model_name: str, field: str, value: str) -> bool:
         """
@@ -50,9 +89,30 @@ class DomainHandler:
         :param value: The value to search for in the field (e.g., 'John Doe').
         :return: True if the record exists, False otherwise.
         """
-        model = odoo.session.env[model_name]
+        model = odoo.get_model(model_name)
         domain = [(field, '=', value)]
-        return bool(model.search(domain, limit=1))
+        # the count is a single integer, no id list is built and sent back
+        return bool(model.search_count(domain))
+
+    def load_dst_ids_by_key(self, model_name: str, key_field: str,
+                            context: Dict = None) -> Optional[Dict[Any, int]]:
+        """
+        Load the id of every destination record by a key field, 1000 records per query, so the existence checks
+        of the migration become dict lookups. The first (lowest) id wins when a key is repeated.
+        :param model_name: The model name (e.g., 'res.partner', 'res.users').
+        :param key_field: The key field (e.g., 'login').
+        :param context: The context of the queries (e.g. {'lang': 'en_US'} for a translated key field).
+        :return: The ids by key, or None when the model has more than PRELOAD_LIMIT records.
+        """
+        model = self.dst_odoo.get_model(model_name)
+        if model.search_count([]) > self.PRELOAD_LIMIT:
+            return None
+        ids_by_key = {}
+        # in pages, so a single response never carries the whole table
+        for rows in self.dst_odoo.iter_records(model_name, fields=[key_field], batch_size=1000, context=context):
+            for row in rows:
+                ids_by_key.setdefault(row[key_field], row['id'])
+        return ids_by_key
 
     def get_item(self, odoo: OdooConnection, model_name: str, _id: int) -> Dict:
         """
@@ -63,35 +123,51 @@ class DomainHandler:
         :return: The record as a dictionary.
         """
         try:
-            model = odoo.session.env[model_name]
-            resp = model.browse(_id).read()[0]  # Ensure record is read and returned as a dict
-            record = dict({key: value for key, value in resp.items() if value is not None})
-            return record
+            model = odoo.get_model(model_name)
+            resp = model.read([_id], self.get_fields(model_name))
         except ValueError as ex:
             _logger.error(str(ex))
             raise ResourceNotFoundException()
+        if not resp:
+            raise ResourceNotFoundException()
+        return resp[0]
 
-    def fetch_items(self, odoo: OdooConnection, model_name: str, domain=None, offset: int = 0, order: str = None,
-                    limit: int = 100) -> List[Dict]:
+    def fetch_items(self, odoo: OdooConnection, model_name: str, domain=None, order: str = None,
+                    limit: int = 100, fields: List[str] = None) -> List[Dict]:
         """
         Retrieve a list of records based on a search domain and convert them to dictionaries.
         :param odoo: The odoo connection.
         :param model_name: The model name (e.g., 'res.partner', 'res.users').
-        :param domain: The search domain.
-        :param offset: The offset for pagination.
+        :param domain: The search domain (add ('id', '>', last_id) to paginate).
         :param limit: The number of records to retrieve.
         :param order: The order for sorting the results.
+        :param fields: The fields to read (the handler FIELDS when not informed).
         :return: A list of records as dictionaries.
         """
-        result = []
-        domain = [] if domain is None else domain
-        model = odoo.session.env[model_name]
-        ids = model.search(domain, offset=offset, limit=limit, order=order)
-        for record in model.browse(ids):
-            result.append(record)
-        return result
+        fields = self.get_fields(model_name) if fields is None else fields
+        return odoo.fetch_items(model_name, domain=domain, order=order, limit=limit, fields=fields)
+
+    def iter_pages(self, model_name: str, batch_size: int = None, domain=None) -> Iterator[List[Dict]]:
+        """
+        Iterate over the source records page by page (see OdooConnection.iter_records).
+        :param model_name: The model name (e.g., 'res.partner', 'res.users').
+        :param batch_size: The number of records per page (FETCH_BATCH_SIZE when not informed).
+        :param domain: The search domain.
+        :return: An iterator of pages, as lists of records.
+        """
+        batch_size = self.FETCH_BATCH_SIZE if batch_size is None else batch_size
+        return self.src_odoo.iter_records(model_name, domain=domain, fields=self.get_fields(model_name),
+                                          batch_size=batch_size)
+
+    def prefetch(self, records: List[Dict]):
+        """
+        Called once per page, before the page is transformed, so subclasses can look up everything
+        the page needs in the destination with a few batched queries instead of one per record.
+        :param records: The records from the source Odoo.
+        """
+        pass
 
-    def apply_transformations(self, record: Dict) -> List[Dict]:
+    def apply_transformations(self, record: Dict) -> List[Op]:
         """
         This method should be overridden by subclasses to apply any necessary transformations
         to the records, such as splitting or merging data.
@@ -100,10 +176,326 @@ class DomainHandler:
         """
         raise NotImplementedError("Subclasses should implement this method.")
 
-    def save_into_destination(self, transformed_records: List[Dict]):
+    def apply_transformations_batch(self, records: List[Dict]) -> List[Op]:
+        """
+        Apply the transformations to a page of records.
+        Subclasses can override it to resolve what the records of the page have in common
+        (e.g. related ids) once, instead of record by record.
+        :param records: The records from the source Odoo.
+        :return: A flat list of transformed records.
+        """
+        return [transformed for record in records for transformed in self.apply_transformations(record)]
+
+    def get_record_key(self, transformed_record: Op) -> Optional[Hashable]:
+        """
+        Return the natural key of the destination record targeted by a transformed record
+        (e.g. the login of a user), used to drop duplicates before saving.
+        :param transformed_record: A transformed record.
+        :return: The key, or None to never consider the record a duplicate.
+        """
+        return None
+
+    def dedupe(self, transformed_records: List[Op]) -> List[Op]:
         """
-        This method should be implemented in subclasses, since each use case might require
-        writing to different models in the destination system.
+        Drop the transformed records targeting the same destination record as a previous one of the page,
+        so they don't cost a create (or write) that would fail or be redundant.
+        The first record of each key wins: the create/update decision is taken against the same destination
+        state for the whole page, so records sharing a key also share the action.
         :param transformed_records: A list of transformed records.
+        :return: The records without duplicates, in their original order.
         """
-        raise NotImplementedError("Subclasses should implement this method.")
+        seen = set()
+        result = []
+        for record in transformed_records:
+            key = self.get_record_key(record)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            result.append(record)
+        return result
+
+    def save_into_destination(self, transformed_records: List[Op]):
+        """
+        Create the transformed records in the destination system, sending up to CREATE_BATCH_SIZE
+        records of the same model per create call. When a batch fails, its records are created one by one
+        so only the faulty ones are left behind. Up to rpc_workers batches are created concurrently.
+        Subclasses should override this method when the records need per-record post-processing.
+        :param transformed_records: A list of transformed records.
+        """
+        values_by_model = {}
+        for record in transformed_records:
+            values_by_model.setdefault(record.model, []).append(record.data)
+
+        for model_name, values in values_by_model.items():
+            model = self.dst_odoo.get_model(model_name)
+
+            def create_chunk(chunk: List[Dict]):
+                try:
+                    model.create(chunk)
+                except Exception as e:
+                    _logger.warning("Failed to create %s records in %s, creating them one by one: %s",
+                                    len(chunk), model_name, e)
+                    for data in chunk:
+                        try:
+                            model.create(data)
+                        except Exception as ex:
+                            _logger.error("Failed to create a record in %s (%s): %s", model_name, data, ex)
+
+            # the batches are independent, so up to rpc_workers of them are sent at the same time
+            self.dst_odoo.map_calls(create_chunk, list(chunks(values, self.CREATE_BATCH_SIZE)))
+
+
+class KeyedUpsertHandler(DomainHandler):
+    """
+    Handler for models whose records are matched between source and destination by a natural key
+    (e.g. the login of the users): the source records whose key already exists in the destination update
+    the existing record, the others are created. Either way, the destination id is written back on the
+    new_id field of the source record, and the source records already linked update their linked destination
+    record, whatever their key. A new_id is only trusted when its destination record still exists and has the
+    source id as old_id (it may be stale, e.g. after the destination database was restored).
+    Subclasses set the model and the fields through the class attributes below.
+    """
+    # Field matching the source and destination records (must be in FIELDS, with 'new_id').
+    # It must be unique: records sharing a key are merged into a single destination record.
+    # When None, the records are only matched by their new_id.
+    LOOKUP_FIELD: str = None
+    # Source fields copied into the new destination records
+    CREATE_FIELDS: List[str] = []
+    # Source fields copied into the existing destination records
+    UPDATE_FIELDS: List[str] = []
+
+    def __init__(self, src_odoo: OdooConnection, dst_odoo: OdooConnection, model_name: str):
+        """
+        Initialize the handler with source and destination Odoo connections and the model name.
+        :param src_odoo: OdooConnection instance for the source Odoo instance.
+        :param dst_odoo: OdooConnection instance for the destination Odoo instance.
+        :param model_name: The model name being handled (e.g., 'res.partner', 'res.users').
+        """
+        super().__init__(src_odoo, dst_odoo, model_name)
+        # destination id by key (None when missing), filled by prefetch()
+        self._dst_ids_by_key: Dict[Any, Optional[int]] = {}
+        # whether every destination key is in _dst_ids_by_key (None until the first prefetch)
+        self._all_keys_loaded: Optional[bool] = None
+        # old_id of the destination records pointed by the source new_id (False when missing), filled by prefetch()
+        self._old_ids_by_dst_id: Dict[int, Any] = {}
+
+    def load_linked(self, records: List[Dict]):
+        """
+        Read the old_id of the destination records pointed by the new_id of the source records, with a single
+        query, so get_linked_dst_id() can tell the valid links from the stale ones.
+        :param records: The source records.
+        """
+        new_ids = list({record['new_id'] for record in records
+                        if record['new_id'] and record['new_id'] not in self._old_ids_by_dst_id})
+        if not new_ids:
+            return
+        model = self.dst_odoo.get_model(self.model_name)
+        # archived records are still linked
+        rows = model.search_read([('id', 'in', new_ids)], ['id', 'old_id'], context={'active_test': False})
+        self._old_ids_by_dst_id.update(dict.fromkeys(new_ids, False))
+        self._old_ids_by_dst_id.update({row['id']: row['old_id'] for row in rows})
+
+    def get_linked_dst_id(self, record: Dict) -> Optional[int]:
+        """
+        Return the destination record the source record is linked to by its new_id, or None when it isn't
+        linked, or when the link is stale: the destination record is gone, or it isn't the one created
+        (or updated) from this source record.
+        :param record: The source record.
+        """
+        new_id = record['new_id']
+        if not new_id:
+            return None
+        if new_id not in self._old_ids_by_dst_id:
+            self.load_linked([record])
+        return new_id if self._old_ids_by_dst_id[new_id] == record['id'] else None
+
+    def prefetch(self, records: List[Dict]):
+        """
+        Check the links of the page (see load_linked), then load every destination key on the first page
+        when there are at most PRELOAD_LIMIT records, otherwise look up the keys of each page of source
+        records with a single query.
+        :param records: The source records.
+        """
+        self.load_linked(records)
+        if not self.LOOKUP_FIELD:
+            return
+        if self._all_keys_loaded is None:
+            dst_ids_by_key = self.load_dst_ids_by_key(self.model_name, self.LOOKUP_FIELD)
+            self._all_keys_loaded = dst_ids_by_key is not None
+            if self._all_keys_loaded:
+                self._dst_ids_by_key = dst_ids_by_key
+        if self._all_keys_loaded:
+            return
+
+        # the records already linked don't need their key, and the known keys aren't looked up again
+        keys = list({record[self.LOOKUP_FIELD]: None for record in records
+                     if record[self.LOOKUP_FIELD] and not self.get_linked_dst_id(record)
+                     and record[self.LOOKUP_FIELD] not in self._dst_ids_by_key})
+        if not keys:
+            return
+        model = self.dst_odoo.get_model(self.model_name)
+        rows = model.search_read([(self.LOOKUP_FIELD, 'in', keys)], ['id', self.LOOKUP_FIELD], order='id')
+        # the save thread may have created some of the keys since the query: never reset them to None
+        for key in keys:
+            self._dst_ids_by_key.setdefault(key, None)
+        for row in rows:
+            self._dst_ids_by_key[row[self.LOOKUP_FIELD]] = row['id']
+
+    def find_dst_id(self, key: Any) -> Optional[int]:
+        """
+        Return the id of the destination record with the given key, or None when there is none.
+        The lookups read only the ids, sorted by id: the default order of models like res.users
+        (name, login) would join res_partner just to sort.
+        The prefetched keys are used first, the others are looked up with a single search_read,
+        whose result is kept so saving the record doesn't look it up again.
+        An empty key never matches: those records are always created.
+        :param key: The key of the source record.
+        """
+        if not key:
+            return None
+        if self._all_keys_loaded or key in self._dst_ids_by_key:
+            return self._dst_ids_by_key.get(key)
+
+        model = self.dst_odoo.get_model(self.model_name)
+        rows = model.search_read([(self.LOOKUP_FIELD, '=', key)], ['id'], limit=1, order='id')
+        if rows:
+            self._dst_ids_by_key[key] = rows[0]['id']
+        else:
+            # unless the save thread created it since the query
+            self._dst_ids_by_key.setdefault(key, None)
+        return self._dst_ids_by_key[key]
+
+    def get_record_key(self, transformed_record: Op) -> Optional[Hashable]:
+        key = transformed_record.src_fields['key']
+        return (transformed_record.model, key) if key else None
+
+    @staticmethod
+    def copy_values(record: Dict, fields: List[str]) -> Dict:
+        """
+        Copy the given fields of a source record, replacing the many2one values ([id, name]) by their id.
+        :param record: The source record.
+        :param fields: The fields to copy.
+        :return: The values.
+        """
+        values = {}
+        for field in fields:
+            value = record[field]
+            values[field] = value[0] if isinstance(value, list) else value
+        return values
+
+    def apply_transformations(self, record: Dict) -> List[Op]:
+        """
+        Transform a source record into an update of its linked destination record (new_id), or of the
+        destination record with the same key, or a create when there is none. The source id is kept in 'old_id'.
+        :param record: The record from the source Odoo.
+        :return: A list with the transformed record.
+        """
+        # a record already linked is never matched by key again, it keeps its destination record
+        linked_dst_id = self.get_linked_dst_id(record)
+        key = record[self.LOOKUP_FIELD] if self.LOOKUP_FIELD and not linked_dst_id else None
+        # source values needed when saving, so the source record doesn't have to be read again
+        src_fields = {'id': record['id'], 'key': key, 'new_id': record['new_id'],
+                      # how the record shows in the logs
+                      'name': key or record.get('name') or record['id']}
+        dst_id = linked_dst_id or self.find_dst_id(key)
+        if dst_id:
+            data = self.copy_values(record, self.UPDATE_FIELDS)
+            data['old_id'] = record['id']
+            # the destination record found above, so saving doesn't have to look it up again
+            return [Op('update', self.model_name, data, src_fields, dst_id)]
+
+        data = self.copy_values(record, self.CREATE_FIELDS)
+        data['old_id'] = record['id']
+        return [Op('create', self.model_name, data, src_fields)]
+
+    def resolve_created(self, record: Op) -> Op:
+        """
+        Turn a create into an update when a record with the same key was created after it was transformed:
+        the pipeline transforms a page while the previous one is being saved, so a key repeated across
+        consecutive pages would be created twice otherwise.
+        :param record: A transformed record.
+        :return: The record, or the update of the destination record already created.
+        """
+        key = record.src_fields['key'] if record.action == 'create' else None
+        dst_id = self._dst_ids_by_key.get(key) if key else None
+        if not dst_id:
+            return record
+        data = {field: record.data[field] for field in self.UPDATE_FIELDS}
+        data['old_id'] = record.data['old_id']
+        return Op('update', record.model, data, record.src_fields, dst_id)
+
+    def create_batch(self, dst_model: Any, batch: List[Op]) -> List[Tuple[Op, int]]:
+        """
+        Create a batch of records with a single create call. When it fails, the records are created one by one,
+        so only the faulty ones are left behind.
+        :param dst_model: The destination model.
+        :param batch: The transformed records to create.
+        :return: The records actually created, with their destination id.
+        """
+        try:
+            # the ids are returned in the same order as the values
+            return list(zip(batch, dst_model.create([record.data for record in batch])))
+        except Exception as e:
+            _logger.warning("Failed to create %s records in %s, creating them one by one: %s",
+                            len(batch), self.model_name, e)
+        created = []
+        for record in batch:
+            try:
+                created.append((record, dst_model.create(record.data)))
+            except Exception as ex:
+                _logger.error("Failed to create %s %r: %s", self.model_name, record.src_fields['name'], ex)
+        return created
+
+    def save_into_destination(self, transformed_records: List[Op]):
+        """
+        Save the transformed records in the destination system.
+        New records are created CREATE_BATCH_SIZE at a time, with a single create call per batch (see
+        create_batch), and the existing ones are updated with a write call per record, sent concurrently
+        (see OdooConnection.map_calls).
+        The new_id write-backs on the source are done once per batch (see OdooConnection.bulk_set_new_id).
+        :param transformed_records: A list of transformed records.
+        """
+        dst_model = self.dst_odoo.get_model(self.model_name)
+        # checked once per page instead of once per record
+        log_records = _logger.isEnabledFor(logging.INFO)
+        transformed_records = [self.resolve_created(record) for record in transformed_records]
+
+        records_to_create = [record for record in transformed_records if record.action == 'create']
+        for batch in chunks(records_to_create, self.CREATE_BATCH_SIZE):
+            created = self.create_batch(dst_model, batch)
+            for record, new_id in created:
+                key = record.src_fields['key']
+                if log_records:
+                    _logger.info("Created %s %r ...", self.model_name, record.src_fields['name'])
+                # keep the preloaded keys consistent with the destination
+                if key:
+                    self._dst_ids_by_key[key] = new_id
+            self.src_odoo.bulk_set_new_id(self.model_name, {record.src_fields['id']: new_id
+                                                            for record, new_id in created})
+
+        records_by_dst_id = {}
+        for record in transformed_records:
+            if record.action != 'update':
+                continue
+            if log_records:
+                _logger.info("Updating %s %r ...", self.model_name, record.src_fields['name'])
+            records_by_dst_id[record.dst_id] = record
+
+        def write_record(item: Tuple[int, Op]) -> bool:
+            dst_id, record = item
+            try:
+                dst_model.write([dst_id], record.data)
+                return True
+            except Exception as e:
+                _logger.error("Failed to update %s %r: %s", self.model_name, record.src_fields['name'], e)
+                return False
+
+        # each payload carries its own old_id, so every record is written separately, up to rpc_workers at a time
+        items = list(records_by_dst_id.items())
+        written = self.dst_odoo.map_calls(write_record, items)
+        # only the records written and not linked yet, the others already have the right new_id
+        self.src_odoo.bulk_set_new_id(self.model_name, {
+            record.src_fields['id']: dst_id for (dst_id, record), ok in zip(items, written)
+            if ok and record.src_fields['new_id'] != dst_id
+        })
@@ -1,11 +1,17 @@
-from typing import Dict, Generic, List, Optional, Type, TypeVar, Union, Any
+import logging
 
-from .base import DomainHandler, ResourceNotFoundException
+from typing import Any, Dict, Hashable, List, Optional
+
+from .base import DomainHandler, Op, ResourceNotFoundException
 from ..core.mapping import MappingProvider
 from ..core.odoo import OdooConnection
 
 
+_logger = logging.getLogger(__name__)
+
+
 class ResGroupsHandler(DomainHandler):
+    FIELDS = ['name', 'company_id', 'comment', 'category_id']
 
     def __init__(self, src_odoo: OdooConnection, dst_odoo: OdooConnection, mapping_provider: MappingProvider):
         """
@@ -18,49 +24,80 @@ class ResGroupsHandler(DomainHandler):
         self.language = dst_odoo.language
         self.company_id = dst_odoo.company_id
         self.mapping_provider = mapping_provider
+        # destination group id by name in the configured language, loaded on first use
+        self._dst_ids_by_name: Optional[Dict[str, int]] = None
+        # destination module category id by name, loaded on first use
+        self._category_ids_by_name: Optional[Dict[str, int]] = None
 
-    def find_category_id(self, source_category_id: int, category_name: str) -> int:
+    def load_dst_categories(self):
         """
-        Find the matching category ID in the destination Odoo (Odoo 16) based on the source category ID from Odoo 11.
-        First check the mappings cache, and if not found, perform a lookup.
-        :param source_category_id: The category ID from the source Odoo.
-        :param category_name: The category name from the source Odoo.
-        :return: The destination category ID.
+        Load the id of every destination module category by its name, with a single query.
+        The categories don't change during the migration, so they are looked up in memory afterwards.
         """
-        # First, check if there's already a mapping for the category_id
-        destination_category_id = self.mapping_provider.get_mapping('ir.module.category', source_category_id)
-        if destination_category_id:
-            return destination_category_id
+        category_model = self.dst_odoo.get_model('ir.module.category')
+        self._category_ids_by_name = {}
+        for row in category_model.search_read([], ['id', 'name'], order='id'):
+            self._category_ids_by_name.setdefault(row['name'], row['id'])
 
     def find_dest_category_id(self, src_category: Any) -> int:
         """
         Find the matching category ID in the destination Odoo (Odoo 16) based on the source category ID from Odoo 11.
-        First check the mappings cache, and if not found, perform a lookup.
-        :param src_category: The source category
+        The destination categories are loaded once, on the first lookup.
+        :param src_category: The source category, as read from the many2one field ([id, name]).
         :return: The destination category ID.
         """
 
-        if src_category is not None:
-            domain = [('name', '=', src_category['name'])]
-            resp = self.dst_odoo.fetch_ids('ir.module.category', domain=domain, limit=1)
-            if resp is not None and len(resp) > 0:
-                return resp[0]
+        if src_category:
+            if self._category_ids_by_name is None:
+                self.load_dst_categories()
+            category_id = self._category_ids_by_name.get(src_category[1])
+            if category_id:
+                return category_id
             else:
-                raise ResourceNotFoundException(f"Was not found a category with name = \"{src_category['name']}\"")
+                raise ResourceNotFoundException(f"Was not found a category with name = \"{src_category[1]}\"")
         else:
             raise ResourceNotFoundException("The category can't be empty")
 
+    def load_dst_groups(self):
+        """
+        Load the id of every destination group by its name in the configured language, with a single query.
+        res.groups is small, so the existence checks become dict lookups instead of one query
+        (and one sequential scan of the untranslated JSON names) per group.
+        """
+        group_model = self.dst_odoo.get_model('res.groups')
+        rows = group_model.search_read([], ['id', 'name'], order='id', context={'lang': self.language})
+        self._dst_ids_by_name = {row['name']: row['id'] for row in rows}
+
+    def prefetch(self, records: List[Dict]):
+        """
+        Make sure the destination groups are loaded before the first page is transformed.
+        :param records: The source groups.
+        """
+        if self._dst_ids_by_name is None:
+            self.load_dst_groups()
+
     def group_exists(self, group_name: str) -> bool:
         """
         Check if the group with the given name (in JSON format) already exists in the destination Odoo system.
         :param group_name: The name of the group in the source system.
         :return: True if the group exists, False otherwise.
         """
-        group_model = self.dst_odoo.session.env['res.groups']
-        domain = [('name->>' + self.language, '=', group_name)]
-        return bool(group_model.search(domain, limit=1))
+        if self._dst_ids_by_name is None:
+            self.load_dst_groups()
+        return group_name in self._dst_ids_by_name
+
+    def get_group_name(self, data: Dict) -> str:
+        """
+        Return the name of a transformed group in the configured language.
+        :param data: The values of the transformed group, with the name as a string or by language.
+        """
+        name = data['name']
+        return name[self.language] if isinstance(name, dict) else name
+
+    def get_record_key(self, transformed_record: Op) -> Optional[Hashable]:
+        return transformed_record.model, self.get_group_name(transformed_record.data)
 
-    def apply_transformations(self, record: Dict) -> List[Dict]:
+    def apply_transformations(self, record: Dict) -> List[Op]:
         """
         Apply transformations to the res.groups records.
         The 'name' field is converted to a JSON format with the configured language.
@@ -70,7 +107,7 @@ class ResGroupsHandler(DomainHandler):
         # Prepare data for res.groups table
         group_data = {
             'name': record['name'],
-            'company_id': record['company_id']['id'],
+            'company_id': record['company_id'][0],
             'comment': record['comment'],
         }
         # Find the matching category ID in the destination Odoo
@@ -78,30 +115,38 @@ class ResGroupsHandler(DomainHandler):
         if category_id:
             group_data['category_id'] = category_id
 
-        transformed_records.append({'model': 'res.groups', 'data': group_data})
+        transformed_records.append(Op('create', 'res.groups', group_data))
 
         return transformed_records
 
-    def save_into_destination(self, transformed_records: List[Dict]):
+    def save_into_destination(self, transformed_records: List[Op]):
         """
         Create the transformed records in the destination system.
         This handles creating res.groups in the destination Odoo (Odoo 16).
         """
+        # the model proxies are resolved once per model, not once per record
+        destination_models = {}
+        log_records = _logger.isEnabledFor(logging.INFO)
         for record in transformed_records:
-            model_name = record['model']
-            data = record['data']
+            model_name = record.model
+            data = record.data
 
-            # Extract the name from the JSON format to check if the group already exists
-            group_name = data['name'][self.language]
+            # Extract the name in the configured language to check if the group already exists
+            group_name = self.get_group_name(data)
 
             # Check if the group already exists before attempting to create it
             if self.group_exists(group_name):
-                print(f"Group '{group_name}' already exists in the destination system. Skipping creation.")
+                if log_records:
+                    _logger.info("Group %r already exists in the destination system. Skipping creation.", group_name)
                 continue
 
             # Destination model handling is specific to this handler, no generic method
-            destination_model = self.dst_odoo.session.env[model_name]
+            destination_model = destination_models.get(model_name)
+            if destination_model is None:
+                destination_model = destination_models[model_name] = self.dst_odoo.get_model(model_name)
 
             # Create the record in the appropriate model/table
             new_id = destination_model.create(data)
-            print(f"Created new group in {model_name} with ID {new_id}")
+            self._dst_ids_by_name[group_name] = new_id
+            if log_records:
+                _logger.info("Created new group in %s with ID %s", model_name, new_id)
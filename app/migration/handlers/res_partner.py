@@ -1,117 +1,58 @@
 import logging
 
-from typing import Dict, Generic, List, Optional, Type, TypeVar, Union, Any
+from typing import Dict, List
 
-from .base import DomainHandler, ResourceNotFoundException
+from .base import KeyedUpsertHandler, Op
 from ..core.mapping import MappingProvider
 from ..core.odoo import OdooConnection
 
-import json
 
+_logger = logging.getLogger(__name__)
 
-class ResUsersHandler(DomainHandler):
+
+class ResPartnerHandler(KeyedUpsertHandler):
+    MAPPINGS = [('res.company', 'name')]
+    FIELDS = ['name', 'email', 'phone', 'mobile', 'street', 'street2', 'zip', 'city', 'vat', 'is_company',
+              'company_id', 'new_id']
+    # No partner field is unique (several partners can share an email, a name or a VAT number), so by default
+    # the partners are only matched by their new_id: the ones not migrated yet are always created.
+    # The 'partner_lookup_field' setting names a field known to be unique in both databases (e.g. 'ref'),
+    # to match the existing destination partners by it.
+    LOOKUP_FIELD = None
+    CREATE_FIELDS = ['name', 'email', 'phone', 'mobile', 'street', 'street2', 'zip', 'city', 'vat', 'is_company',
+                     'company_id']
+    UPDATE_FIELDS = ['name', 'email', 'phone', 'mobile']
 
     def __init__(self, src_odoo: OdooConnection, dst_odoo: OdooConnection, mapping_provider: MappingProvider):
         """
-        Initialize the ResGroupsHandler with the source and destination Odoo connections, and the MappingProvider.
+        Initialize the ResPartnerHandler with the source and destination Odoo connections, and the MappingProvider.
         :param src_odoo: OdooConnection instance for the source Odoo.
         :param dst_odoo: OdooConnection instance for the destination Odoo.
         :param mapping_provider: An instance of MappingProvider to handle ID mappings.
         """
-        super().__init__(src_odoo, dst_odoo, 'res.users')
-        self.language = dst_odoo.language
-        self.company_id = dst_odoo.company_id
-        self.mapping_provider = mapping_provider
-
-    def find_dest_group_id(self, src_group: Any) -> Optional[int]:
+        super().__init__(src_odoo, dst_odoo, 'res.partner')
+        lookup_field = mapping_provider.configs.get('settings', 'partner_lookup_field', fallback=None)
+        if lookup_field:
+            self.LOOKUP_FIELD = lookup_field
+            if lookup_field not in self.FIELDS:
+                self.FIELDS = self.FIELDS + [lookup_field]
+        # source -> destination res.company ids
+        self._company_map = mapping_provider.get_model_mappings('res.company')
+
+    def apply_transformations(self, record: Dict) -> List[Op]:
         """
-        Find the matching category ID in the destination Odoo (Odoo 16) based on the source category ID from Odoo 11.
-        First check the mappings cache, and if not found, perform a lookup.
-        :param src_group: The source category
-        :return: The destination category ID.
+        Transform a source partner (see KeyedUpsertHandler.apply_transformations), replacing its company
+        by the destination one.
+        :param record: The record from the source Odoo.
+        :return: A list with the transformed record.
         """
-
-        if src_group is not None:
-            domain = [('name', '=', src_group['name'])]
-            resp = self.dst_odoo.fetch_ids('res.groups', domain=domain, limit=1)
-            if resp is not None and len(resp) > 0:
-                return resp[0]
-        return None
-
-    def user_exists(self, login: str) -> bool:
-        domain = [('login', '=', login)]
-        model = self.dst_odoo.session.env[self.model_name]
-        ids = model.search(domain, limit=1)
-        return ids is not None and len(ids) > 0
-
-    def apply_transformations(self, record: Any) -> List[Dict]:
-
-        transformed_records = []
-        if self.user_exists(record.login):
-            user_dst_data = {
-                'login': record.login,
-                'old_id': record.id,
-                'name': record.name
-            }
-            transformed_records.append({ 'action': 'update', 'model': self.model_name, 'data': user_dst_data})
-
-        else:
-
-            # dst_group_ids = []
-            # for src_group in record.groups_id:
-            #     dst_group_id = self.find_dest_group_id(src_group)
-            #     if dst_group_id is not None:
-            #         dst_group_ids.append(dst_group_id)
-
-            # data = record.read()[0]
-            # sdata = json.dumps(data)
-            # print(sdata)
-
-            user_dst_data = {
-                'name': record.name,
-                'login': record.login,
-                'email': record.email,
-                'company_id': record.company_id.id,
-                'lang': record.lang,
-                'tz': record.tz,
-                # 'groups_id': [(6, 0, dst_group_ids)],
-                'old_id': record.id
-            }
-            transformed_records.append({'action': 'create', 'model': self.model_name, 'data': user_dst_data})
-
+        transformed_records = super().apply_transformations(record)
+        for transformed in transformed_records:
+            src_company_id = transformed.data.get('company_id')
+            if src_company_id:
+                dst_company_id = self._company_map.get(src_company_id)
+                if not dst_company_id:
+                    _logger.warning("No destination company for the company %s of the partner %r, "
+                                    "the partner is shared between companies", src_company_id, record['name'])
+                transformed.data['company_id'] = dst_company_id or False
         return transformed_records
-
-    def save_into_destination(self, transformed_records: List[Dict]):
-        """
-        Save the transformed records in the destination system.
-        This handles creating res.users in the destination Odoo (Odoo 16).
-        """
-        for record in transformed_records:
-            model_name = record['model']
-            data = record['data']
-            action = record['action']
-
-            src_model = self.src_odoo.session.env[self.model_name]
-            src_record = src_model.browse(data['old_id'])
-
-            dst_model = self.dst_odoo.session.env[model_name]
-
-            if action == 'create':
-                logging.info(f"Creating user \"{src_record.login}\" ...")
-                new_id = dst_model.create(data)
-                src_record.write({'new_id': new_id})
-            elif action == 'update':
-                logging.info(f"Updating user \"{src_record.login}\" ...")
-                dst_record = None
-                if src_record.new_id is not None and src_record.new_id > 0:
-                    dst_record = dst_model.browse(src_record.new_id)
-                else:
-                    domain = [('login', '=', src_record.login)]
-                    result = dst_model.search(domain=domain, limit=1)
-                    if result is not None and len(result) > 0:
-                        dst_record = dst_model.browse(result[0])
-
-                if dst_record is not None:
-                    src_record.write({'new_id': dst_record.id})
-                    dst_record.write(data)
-
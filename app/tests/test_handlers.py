@@ -0,0 +1,171 @@
+import unittest
+
+from migration.handlers.base import KeyedUpsertHandler, Op
+
+
+class FakeModel:
+    """
+    In-memory stand-in for an odoorpc model proxy, supporting the calls made by the handlers.
+    """
+
+    def __init__(self, rows, next_id=1000):
+        self.rows = [dict(row) for row in rows]
+        self.next_id = next_id
+        self.failing_ids = set()
+
+    @staticmethod
+    def _match(row, domain):
+        for field, operator, value in domain:
+            if operator == '=' and row.get(field) != value:
+                return False
+            if operator == 'in' and row.get(field) not in value:
+                return False
+            if operator == '>' and not row.get(field) > value:
+                return False
+        return True
+
+    def search_count(self, domain):
+        return len(self.search_read(domain))
+
+    def search_read(self, domain, fields=None, limit=None, order=None, context=None):
+        rows = [dict(row) for row in sorted(self.rows, key=lambda row: row['id']) if self._match(row, domain)]
+        return rows[:limit] if limit else rows
+
+    def create(self, values):
+        if isinstance(values, list):
+            return [self.create(value) for value in values]
+        self.next_id += 1
+        self.rows.append(dict(values, id=self.next_id))
+        return self.next_id
+
+    def write(self, ids, values):
+        if self.failing_ids.intersection(ids):
+            raise ValueError("write failed")
+        for row in self.rows:
+            if row['id'] in ids:
+                row.update(values)
+        return True
+
+    def get(self, record_id):
+        return next((row for row in self.rows if row['id'] == record_id), None)
+
+
+class FakeConnection:
+    """
+    In-memory stand-in for an OdooConnection, with a single model.
+    """
+
+    def __init__(self, model_name, model):
+        self.models = {model_name: model}
+
+    def get_model(self, model_name):
+        return self.models[model_name]
+
+    def iter_records(self, model_name, domain=None, fields=None, batch_size=500, context=None):
+        yield self.models[model_name].search_read(domain or [], fields)
+
+    def map_calls(self, func, items):
+        return [func(item) for item in items]
+
+    def bulk_set_new_id(self, model_name, new_ids_by_id):
+        for record_id, new_id in new_ids_by_id.items():
+            self.models[model_name].get(record_id)['new_id'] = new_id
+
+
+class UsersHandler(KeyedUpsertHandler):
+    FIELDS = ['name', 'login', 'new_id']
+    LOOKUP_FIELD = 'login'
+    CREATE_FIELDS = ['name', 'login']
+    UPDATE_FIELDS = ['name']
+
+
+class KeyedUpsertHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.src_model = FakeModel([])
+        self.dst_model = FakeModel([
+            {'id': 2, 'login': 'admin', 'name': 'Administrator', 'old_id': False},
+            {'id': 5, 'login': 'john', 'name': 'John', 'old_id': 1},
+            {'id': 6, 'login': 'mary', 'name': 'Mary', 'old_id': False},
+        ])
+        self.handler = UsersHandler(FakeConnection('res.users', self.src_model),
+                                    FakeConnection('res.users', self.dst_model), 'res.users')
+
+    def migrate(self, *records):
+        self.src_model.rows = [dict(record) for record in records]
+        records = self.src_model.search_read([])
+        self.handler.prefetch(records)
+        transformed_records = self.handler.dedupe(self.handler.apply_transformations_batch(records))
+        self.handler.save_into_destination(transformed_records)
+        return transformed_records
+
+    def test_linked_record_updates_its_destination_record(self):
+        [op] = self.migrate({'id': 1, 'name': 'John Doe', 'login': 'john.doe', 'new_id': 5})
+        self.assertEqual((op.action, op.dst_id), ('update', 5))
+        self.assertEqual(self.dst_model.get(5)['name'], 'John Doe')
+        self.assertEqual(self.src_model.get(1)['new_id'], 5)
+
+    def test_stale_link_to_another_record_is_not_followed(self):
+        [op] = self.migrate({'id': 3, 'name': 'Paul', 'login': 'paul', 'new_id': 2})
+        self.assertEqual(op.action, 'create')
+        self.assertEqual(self.dst_model.get(2)['name'], 'Administrator')
+        new_id = self.src_model.get(3)['new_id']
+        self.assertNotEqual(new_id, 2)
+        self.assertEqual(self.dst_model.get(new_id)['login'], 'paul')
+
+    def test_stale_link_to_a_missing_record_falls_back_to_the_key(self):
+        [op] = self.migrate({'id': 4, 'name': 'Mary Jane', 'login': 'mary', 'new_id': 99})
+        self.assertEqual((op.action, op.dst_id), ('update', 6))
+        self.assertEqual(self.dst_model.get(6)['name'], 'Mary Jane')
+        self.assertEqual(self.src_model.get(4)['new_id'], 6)
+
+    def test_key_match_updates_the_destination_record(self):
+        [op] = self.migrate({'id': 4, 'name': 'Mary Jane', 'login': 'mary', 'new_id': False})
+        self.assertEqual((op.action, op.dst_id), ('update', 6))
+        self.assertEqual(self.dst_model.get(6)['old_id'], 4)
+        self.assertEqual(self.src_model.get(4)['new_id'], 6)
+
+    def test_unknown_key_creates_the_record(self):
+        [op] = self.migrate({'id': 7, 'name': 'Ann', 'login': 'ann', 'new_id': False})
+        self.assertEqual(op.action, 'create')
+        new_id = self.src_model.get(7)['new_id']
+        self.assertEqual(self.dst_model.get(new_id), {'id': new_id, 'name': 'Ann', 'login': 'ann', 'old_id': 7})
+
+    def test_resolve_created_turns_a_repeated_key_into_an_update(self):
+        self.src_model.rows = [{'id': 7, 'name': 'Ann', 'login': 'ann', 'new_id': False},
+                               {'id': 8, 'name': 'Ann B.', 'login': 'ann', 'new_id': False}]
+        first_page, second_page = [self.src_model.search_read([('id', '=', record_id)]) for record_id in (7, 8)]
+        # the second page is transformed before the first one is saved, like in the pipeline
+        self.handler.prefetch(first_page)
+        first_ops = self.handler.apply_transformations_batch(first_page)
+        self.handler.prefetch(second_page)
+        second_ops = self.handler.apply_transformations_batch(second_page)
+        self.assertEqual(second_ops[0].action, 'create')
+
+        self.handler.save_into_destination(first_ops)
+        new_id = self.src_model.get(7)['new_id']
+        resolved = self.handler.resolve_created(second_ops[0])
+        self.assertEqual((resolved.action, resolved.dst_id), ('update', new_id))
+        self.handler.save_into_destination(second_ops)
+        self.assertEqual(self.src_model.get(8)['new_id'], new_id)
+        self.assertEqual(len([row for row in self.dst_model.rows if row['login'] == 'ann']), 1)
+
+    def test_failed_write_only_skips_its_record(self):
+        self.dst_model.failing_ids.add(5)
+        with self.assertLogs('migration.handlers.base', 'ERROR'):
+            self.migrate({'id': 1, 'name': 'John Doe', 'login': 'john', 'new_id': False},
+                         {'id': 4, 'name': 'Mary Jane', 'login': 'mary', 'new_id': False})
+        self.assertEqual(self.dst_model.get(5)['name'], 'John')
+        self.assertFalse(self.src_model.get(1)['new_id'])
+        self.assertEqual(self.dst_model.get(6)['name'], 'Mary Jane')
+        self.assertEqual(self.src_model.get(4)['new_id'], 6)
+
+    def test_transform_keeps_the_source_id(self):
+        self.handler.prefetch([{'id': 7, 'name': 'Ann', 'login': 'ann', 'new_id': False}])
+        [op] = self.handler.apply_transformations({'id': 7, 'name': 'Ann', 'login': 'ann', 'new_id': False})
+        self.assertEqual(op, Op('create', 'res.users', {'name': 'Ann', 'login': 'ann', 'old_id': 7},
+                                {'id': 7, 'key': 'ann', 'new_id': False, 'name': 'ann'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
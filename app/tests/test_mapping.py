@@ -0,0 +1,60 @@
+import tempfile
+import unittest
+
+from migration.core.mapping import LargeMappingStore
+
+
+class LargeMappingStoreTest(unittest.TestCase):
+
+    def test_get_and_set(self):
+        store = LargeMappingStore()
+        store[3] = 30
+        store[1] = 10
+        self.assertEqual(store.get(3), 30)
+        self.assertEqual(store.get(1), 10)
+        self.assertIsNone(store.get(2))
+        self.assertEqual(store.get(2, -1), -1)
+
+        store.finalize()
+        store[3] = 33
+        self.assertEqual(store.get(3), 33)
+        self.assertEqual(len(store), 2)
+
+    def test_merge_keeps_the_ids_sorted(self):
+        store = LargeMappingStore()
+        store.PENDING_LIMIT = 10
+        for source_id in range(100, 0, -1):
+            store[source_id] = source_id * 10
+        self.assertEqual(list(store.items()), [(source_id, source_id * 10) for source_id in range(1, 101)])
+        self.assertEqual(len(store), 100)
+
+    def test_update_overwrites_existing_ids(self):
+        store = LargeMappingStore()
+        store.update({1: 10, 2: 20})
+        store.update({2: 22, 3: 30})
+        self.assertEqual(list(store.items()), [(1, 10), (2, 22), (3, 30)])
+
+    def test_save_and_load(self):
+        store = LargeMappingStore()
+        store.update({5: 50, 1: 10})
+        with tempfile.TemporaryFile() as f:
+            store.save(f)
+            f.seek(0)
+            loaded = LargeMappingStore()
+            loaded.load(f)
+        self.assertEqual(list(loaded.items()), [(1, 10), (5, 50)])
+
+    def test_load_merges_into_the_current_mappings(self):
+        store = LargeMappingStore()
+        store.update({5: 50, 1: 10})
+        loaded = LargeMappingStore()
+        loaded.update({1: 11, 7: 70})
+        with tempfile.TemporaryFile() as f:
+            store.save(f)
+            f.seek(0)
+            loaded.load(f)
+        self.assertEqual(list(loaded.items()), [(1, 10), (5, 50), (7, 70)])
+
+
+if __name__ == '__main__':
+    unittest.main()